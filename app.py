@@ -3,7 +3,13 @@ import os
 from dotenv import load_dotenv
 from fasthtml.common import *
 import random
-import json
+import orjson
+import threading
+import uuid
+from collections import OrderedDict
+from html import escape
+from itertools import chain, islice
+from math import exp, floor, log
 
 # Load environment variables from .env file
 load_dotenv()
@@ -12,13 +18,66 @@ secret_key = os.getenv('SECRET_KEY')
 # === GAME DATA AND QUESTION GENERATION ===
 def load_games():
     """Load games list from JSON file."""
-    with open('games.json', 'r') as f:
-        return json.load(f)
+    with open('games.json', 'rb') as f:
+        return orjson.loads(f.read())
 
 def load_descriptions():
     """Load pre-generated game descriptions."""
-    with open('game_descriptions.json', 'r') as f:
-        return json.load(f)
+    with open('game_descriptions.json', 'rb') as f:
+        return orjson.loads(f.read())
+
+def index_games_by_genre(games):
+    """Group game titles by genre so questions never rescan the full list."""
+    games_by_genre = {}
+    for g in games:
+        games_by_genre.setdefault(g['genre'], []).append(g['game'])
+    return games_by_genre
+
+def pick_titles(pool, k, exclude):
+    """
+    Pick up to k distinct titles from pool, skipping any in exclude.
+    Sampling k + len(exclude) titles guarantees k survivors whenever the pool has them,
+    so there's no open-ended retry loop when a genre is nearly used up.
+    """
+    sample_size = min(len(pool), k + len(exclude))
+    return [t for t in random.sample(pool, sample_size) if t not in exclude][:k]
+
+def pick_title(pool, exclude, attempts=3):
+    """
+    Pick one title from pool that isn't in exclude, or None if there isn't one.
+    A couple of random.choice() draws almost always hit, so only fall back to
+    pick_titles() when the pool is crowded with excluded titles.
+    """
+    for _ in range(attempts):
+        title = random.choice(pool)
+        if title not in exclude:
+            return title
+    picked = pick_titles(pool, 1, exclude)
+    return picked[0] if picked else None
+
+def reservoir_sample_l(iterable, k=5):
+    """
+    Pick k items uniformly at random from iterable in a single pass.
+
+    Li's Algorithm L: rather than rolling a die for every item, it jumps
+    straight to the next item that would replace one in the reservoir,
+    so it only needs O(k(1 + log(n/k))) random numbers.
+    """
+    it = iter(iterable)
+    reservoir = list(islice(it, k))
+    if len(reservoir) < k:
+        return reservoir
+
+    # random() can return 0.0, which log() can't take
+    w = exp(log(random.random() or 1e-300) / k)
+    while True:
+        skip = floor(log(random.random() or 1e-300) / log(1 - w))
+        # Jump over the skipped items and take the one after them
+        item = next(islice(it, skip, None), _EXHAUSTED)
+        if item is _EXHAUSTED:
+            return reservoir
+        reservoir[random.randrange(k)] = item
+        w *= exp(log(random.random() or 1e-300) / k)
 
 def create_questions():
     """
@@ -30,56 +89,103 @@ def create_questions():
     - Two games from different genres (as decoys)
     
     All choices are randomly shuffled.
+
+    Questions are stored compactly as [correct_idx, description_idx, choice_ids]:
+    choice_ids index into ID_TO_TITLE, correct_idx is the position of the right
+    answer among them and description_idx indexes that game's descriptions.
+    They're only resolved back to strings when rendered.
     """
-    available_games = load_games().copy()
     questions = []
-
-    for i in range(5):
-        # Select random game for this question
-        idx = random.randint(0, len(available_games) - 1)
-        # Remove selected game from available pool to avoid duplicates
-        random_game = available_games.pop(idx)
-        game_title = random_game['game']
-        game_genre = random_game['genre']
+    # Pick all 5 correct answers in one pass over the games
+    chosen_titles = reservoir_sample_l(ALL_TITLES, 5)
+    # Reservoir slots keep some of the list order, so mix the question order up
+    random.shuffle(chosen_titles)
+    # Correct answers are never offered as wrong answers
+    used_titles = set(chosen_titles)
+    # pick a random description for each game in one pass
+    description_idxs = [random.randrange(len(descriptions[t])) for t in chosen_titles]
+
+    for game_title, description_idx in zip(chosen_titles, description_idxs):
+        game_genre = GENRE_BY_TITLE[game_title]
 
         # Try to find a game from the same genre for a "challenging" wrong answer option
-        same_genre_games = [g for g in available_games if g['genre'] == game_genre]
-
-        if same_genre_games:
-            same_genre_choice = random.choice(same_genre_games)['game']
-        else:
+        same_genre_pool = GAMES_BY_GENRE[game_genre]
+        same_genre_choice = None
+        # A genre of one is just this game, so don't bother looking
+        if len(same_genre_pool) > 1:
+            same_genre_choice = pick_title(same_genre_pool, used_titles)
+        if same_genre_choice is None:
             # Fallback to different genre if no same-genre games available
-            diff_genre_games = [g for g in available_games if g['genre'] != game_genre]
-            same_genre_choice = random.choice(diff_genre_games)['game']
-        
+            same_genre_choice = pick_title(OTHER_GENRE_GAMES[game_genre], used_titles)
+
         # Select 2 games from different genres as additional wrong answers
-        diff_genre_games = [g for g in available_games if g['genre'] != game_genre]
-        # Is O(1)
-        idx1 = random.randint(0, len(diff_genre_games) - 1)
-        # Is O(n) = elements have to be moved after pop()
-        first_choice = diff_genre_games.pop(idx1)
-        idx2 = random.randint(0, len(diff_genre_games) - 1)
-        second_choice = diff_genre_games.pop(idx2)
-        diff_genre_choices = [first_choice['game'], second_choice['game']]
-
-        # pick random description for this game
-        description = random.choice(descriptions[game_title])
-
-        # Combine all choices and randomise order
-        all_choices = [game_title, same_genre_choice] + diff_genre_choices
-        random.shuffle(all_choices)
+        diff_genre_choices = pick_titles(OTHER_GENRE_GAMES[game_genre], 2,
+                                         used_titles | {same_genre_choice})
+
+        # Combine all choices and randomise order.
+        # The correct answer starts at 0, so its shuffled position falls out of the permutation.
+        all_choices = [TITLE_TO_ID[t] for t in [game_title, same_genre_choice] + diff_genre_choices]
+        order = random.sample(range(4), 4)
         
-        questions.append({
-            'description': description,
-            'correct_answer': game_title,
-            'choices': all_choices
-        })
+        questions.append([
+            order.index(0),
+            description_idx,
+            [all_choices[i] for i in order]
+        ])
 
     return questions
 
-# load game descriptions
+# Load the game data once at import rather than on every quiz start.
+# GAMES is a tuple so nothing can mutate the shared list between requests.
+GAMES = tuple(load_games())
 descriptions = load_descriptions()
 
+# Index the games so each question is a few dict lookups
+ALL_TITLES = [g['game'] for g in GAMES]
+# Compact ids for stored questions
+ID_TO_TITLE = tuple(ALL_TITLES)
+TITLE_TO_ID = {title: i for i, title in enumerate(ID_TO_TITLE)}
+GENRE_BY_TITLE = {g['game']: g['genre'] for g in GAMES}
+GAMES_BY_GENRE = index_games_by_genre(GAMES)
+# Sentinel for reservoir_sample_l() running off the end of its input
+_EXHAUSTED = object()
+# "Every genre but X" pools, so decoys are a lookup plus random.sample
+OTHER_GENRE_GAMES = {
+    genre: tuple(g['game'] for g in GAMES if g['genre'] != genre)
+    for genre in GAMES_BY_GENRE
+}
+
+# === QUIZ STORAGE ===
+# Questions are kept server-side so the signed session cookie only carries
+# a short quiz id instead of every description and choice.
+QUIZ_CACHE_SIZE = 1024
+QUIZ_CACHE = OrderedDict()
+_quiz_cache_lock = threading.Lock()
+
+def store_quiz(questions):
+    """Save a new quiz and return the id to keep in the session."""
+    quiz_id = uuid.uuid4().hex
+    with _quiz_cache_lock:
+        QUIZ_CACHE[quiz_id] = questions
+        # Evict the least recently used quiz once the cache is full
+        if len(QUIZ_CACHE) > QUIZ_CACHE_SIZE:
+            QUIZ_CACHE.popitem(last=False)
+    return quiz_id
+
+def get_quiz(session):
+    """Questions for the session's quiz, or None if it was never started or has been evicted."""
+    quiz_id = session.get('QUIZ_ID')
+    with _quiz_cache_lock:
+        questions = QUIZ_CACHE.get(quiz_id)
+        if questions is not None:
+            QUIZ_CACHE.move_to_end(quiz_id)
+    return questions
+
+def drop_quiz(session):
+    """Forget the session's quiz, if it has one."""
+    with _quiz_cache_lock:
+        QUIZ_CACHE.pop(session.get('QUIZ_ID'), None)
+
 # === APP INITIALISATION ===
 app, rt = fast_app(pico=False,
                     hdrs=(
@@ -131,9 +237,9 @@ def StartButton():
             cls = cls
         )
 
-def AnswerButton(choice, idx):
+def answer_button_cls(idx):
     """
-    Coloured answer button with accessibility support.
+    Class string for the answer button in position idx.
     Each of the 4 buttons gets a different colour (green, purple, orange, pink).
     Includes high-contrast colours for both light and dark modes.
     """
@@ -155,13 +261,20 @@ def AnswerButton(choice, idx):
         "h-24 flex items-center justify-center"
     )
 
+    return f"{base_cls} {color_cls}"
+
+def AnswerButton(choice, idx):
+    """
+    Coloured answer button with accessibility support.
+    Class strings and hx-vals come from tuples built once at import.
+    """
     return Button(
         choice,
         hx_post='/answer',
-        hx_vals=f'{{"choice_idx": {idx}}}',  # Pass button index to identify which answer was chosen
+        hx_vals=ANSWER_BUTTON_VALS[idx],  # Pass button index to identify which answer was chosen
         hx_target='#quiz-content',
         hx_swap="outerHTML swap:0.2s settle:0.2s",
-        cls=f"{base_cls} {color_cls}"
+        cls=ANSWER_BUTTON_CLS[idx]
     )
 
 def ActionButton(text, hx_get_url, **kwargs):
@@ -198,6 +311,107 @@ def SeeResultsButton():
     """Show final results after last question."""
     return ActionButton("See Results", '/results')
 
+def QuestionSection(q_index, description, choices):
+    """
+    Question with its 4 multiple choice answers.
+    Answers are displayed in a 2x2 grid layout.
+    """
+    return Section(
+        H1(f"Question {q_index + 1} of 5", cls="text-4xl font-bold text-center"),
+        P(I(f"{description}."), cls="text-3xl font-bold text-center focus:outline-none"),
+        # keyboard accessiblity flow
+        P("Is it...", cls="text-2xl font-bold text-center focus:outline-none", **focus_attrs),
+        # Answer buttons in 2x2 grid layout
+        Div(
+            *[AnswerButton(choice, i) for i, choice in enumerate(choices)],
+            cls="grid grid-cols-2 gap-4"
+        ),
+        cls="space-y-14",
+        id="quiz-content"
+    )
+
+def ResultsSection(score, total=5):
+    """
+    Final quiz results with score and performance message.
+    Message and emoji vary based on how many questions were answered correctly.
+    """
+    # Build results message
+    if score == total:
+        emoji = "🏆"
+        message = "Every answer landed like a headshot. Boom!"
+    elif score >= 4:
+        emoji = "🌟"
+        message = "One slip, but the rest were clean combos."
+    elif score >= 3:
+        emoji = "👾"
+        message = "Not quite a speed run."
+    elif score >= 2:
+        emoji = "🕹️"
+        message = "Button masher!"
+    else:
+        emoji = "📺"
+        message = "Every expert was once a beginner."
+    
+    return Section(
+        Span(emoji, cls="text-3xl font-bold block text-center"),
+        H1(f"{score} out of {total}", cls="text-4xl font-bold text-center"),
+        P(message, cls="text-2xl font-bold text-center focus:outline-none", **focus_attrs),
+        PLAY_AGAIN_BUTTON,
+        cls="space-y-14",
+        id="quiz-content"
+    )
+
+# === STATIC COMPONENTS ===
+# These never change between requests, so build them once at import
+# and hand the same objects back from the routes.
+ANSWER_BUTTON_CLS = tuple(answer_button_cls(i) for i in range(4))
+ANSWER_BUTTON_VALS = tuple(f'{{"choice_idx": {i}}}' for i in range(4))
+NEXT_BUTTON = NextButton()
+PLAY_AGAIN_BUTTON = PlayAgainButton()
+SEE_RESULTS_BUTTON = SeeResultsButton()
+
+# Start screen section that will be swapped by htmx
+HOME_SECTION = Section(
+        Span("🎮", cls="text-4xl font-bold block text-center"),
+        H1("The Weakest Hint", cls="text-4xl font-bold text-center"),
+        P("Can you guess the video game from a bad one-line description?", cls="text-3xl font-bold text-center focus:outline-none", **focus_attrs),
+        StartButton(),
+        cls="space-y-14",
+        id="quiz-content"
+    )
+# Full page version of the start screen for direct visits
+HOME_PAGE = Body(Main(HOME_SECTION, cls='max-w-[720px] min-h-[500px] mx-auto mt-32 my-8 p-8 rounded-2xl shadow-2xl'))
+
+# === PRERENDERED HTML ===
+# htmx swaps of the start, question and results screens are served from HTML
+# rendered here once, skipping FastHTML's component rendering per request.
+# Full page loads still go through FastHTML, which adds the <head> and the
+# per-request canonical link.
+HOME_SECTION_HTML = to_xml(HOME_SECTION).encode()
+# One per possible score, 0 to 5
+RESULTS_HTML = tuple(to_xml(ResultsSection(score)).encode() for score in range(6))
+
+# Question shells, one per position, split around the description and choice slots
+_SLOT = '__SLOT__'
+QUESTION_TEMPLATES = tuple(to_xml(QuestionSection(i, _SLOT, [_SLOT] * 4)).split(_SLOT) for i in range(5))
+
+# FastHTML sends this on every page, so caches keep fragments and full pages apart
+FRAGMENT_HEADERS = {"vary": "HX-Request, HX-History-Restore-Request"}
+
+def is_htmx_swap(request):
+    """True when htmx wants just a fragment (not a direct visit or a history restore)."""
+    return 'HX-Request' in request.headers and 'HX-History-Restore-Request' not in request.headers
+
+def FragmentResponse(html):
+    """Prerendered fragment for an htmx swap."""
+    return HTMLResponse(html, headers=FRAGMENT_HEADERS)
+
+def fill_question_template(q_index, description, choices):
+    """Drop a question's (escaped) description and choices into its prerendered shell."""
+    values = [escape(v, quote=False) for v in (description, *choices)]
+    parts = QUESTION_TEMPLATES[q_index]
+    return ''.join(chain.from_iterable(zip(parts, values))) + parts[-1]
+
 # === ROUTES ===
 @rt('/')
 def get(session, request):
@@ -206,28 +420,19 @@ def get(session, request):
     Clears any existing session data and displays the quiz title and start button.
     """
     # Clear session to ensure fresh start
+    drop_quiz(session)
     session.clear()
     
-    # Main content section that will be swapped by htmx
-    content = Section(
-            Span("🎮", cls="text-4xl font-bold block text-center"),
-            H1("The Weakest Hint", cls="text-4xl font-bold text-center"),
-            P("Can you guess the video game from a bad one-line description?", cls="text-3xl font-bold text-center focus:outline-none", **focus_attrs),
-            StartButton(),
-            cls="space-y-14",
-            id="quiz-content"
-        )
-    
     # Return just the Section for htmx requests (partial updates),
     # but wrap it in Main for full page loads to maintain proper layout.
     # This prevents duplicate Main elements when "Play Again" is clicked.
     if 'HX-Request' in request.headers:
-        return content
+        return FragmentResponse(HOME_SECTION_HTML) if is_htmx_swap(request) else HOME_SECTION
     else:
-        return Body(Main(content, cls='max-w-[720px] min-h-[500px] mx-auto mt-32 my-8 p-8 rounded-2xl shadow-2xl'))
+        return HOME_PAGE
 
 @rt('/generate_questions')
-def get(session):
+def get(session, request):
     """
     Generate quiz questions and initialise session state.
     Called when user clicks "Start Quiz" button.
@@ -238,73 +443,78 @@ def get(session):
     # Initialise session tracking variables
     session['CURRENT_QUESTION_IDX'] = 0  # Track which question we're on
     session['SCORE'] = 0                  # Track correct answers
-    session['QUESTIONS'] = questions      # Store all questions for the session
+    session['QUIZ_ID'] = store_quiz(questions)  # Questions themselves stay server-side
     
     # Display the first question
-    return render_question(questions[0], 0)
+    return render_question(request, questions[0], 0)
 
-def render_question(q_data, q_index):
+def render_question(request, q_data, q_index):
     """
     Render a question with its 4 multiple choice answers.
-    Answers are displayed in a 2x2 grid layout.
+    htmx swaps fill in the prerendered shell; anything else gets the full component.
     """
-    
-    return Section(
-        H1(f"Question {q_index + 1} of 5", cls="text-4xl font-bold text-center"),
-        P(I(f"{q_data['description']}."), cls="text-3xl font-bold text-center focus:outline-none"),
-        # keyboard accessiblity flow
-        P("Is it...", cls="text-2xl font-bold text-center focus:outline-none", **focus_attrs),
-        # Answer buttons in 2x2 grid layout
-        Div(
-            *[AnswerButton(choice, i) for i, choice in enumerate(q_data['choices'])],
-            cls="grid grid-cols-2 gap-4"
-        ),
-        cls="space-y-14",
-        id="quiz-content"
-    )
+    correct_idx, description_idx, choice_ids = q_data
+    description = descriptions[ID_TO_TITLE[choice_ids[correct_idx]]][description_idx]
+    choices = [ID_TO_TITLE[choice_id] for choice_id in choice_ids]
+
+    if is_htmx_swap(request):
+        return FragmentResponse(fill_question_template(q_index, description, choices))
+    return QuestionSection(q_index, description, choices)
 
 @rt('/question')
-def get(session):
+def get(session, request):
     """
     Display current question based on session state.
     Used when navigating between questions via "Next Question" button.
     """
+    questions = get_quiz(session)
+    # Quiz expired from the cache (or never started) - back to the start screen
+    if questions is None:
+        session.clear()
+        return FragmentResponse(HOME_SECTION_HTML) if is_htmx_swap(request) else HOME_SECTION
+
     # Get current question index from session
     q_idx = session.get('CURRENT_QUESTION_IDX', 0)
     # Render the question at that index
-    return render_question(session['QUESTIONS'][q_idx], q_idx)
+    return render_question(request, questions[q_idx], q_idx)
 
 @rt('/answer')
-def post(session, choice_idx: int):
+def post(session, request, choice_idx: int):
     """
     Process user's answer and show feedback.
     Updates score if correct, then shows either next question button or results button.
     """
+    questions = get_quiz(session)
+    # Quiz expired from the cache (or never started) - back to the start screen
+    if questions is None:
+        session.clear()
+        return FragmentResponse(HOME_SECTION_HTML) if is_htmx_swap(request) else HOME_SECTION
+
     # Get current question data
     q_idx = session.get('CURRENT_QUESTION_IDX', 0)
-    q = session['QUESTIONS'][q_idx]
+    correct_idx, _, choice_ids = questions[q_idx]
+    correct_answer = ID_TO_TITLE[choice_ids[correct_idx]]
     
     # Check if the chosen answer (by index) matches the correct answer
-    chosen_answer = q['choices'][choice_idx]
-    is_correct = (chosen_answer == q['correct_answer'])
+    is_correct = (choice_idx == correct_idx)
     
     # Prepare feedback message based on correctness
     if is_correct:
         session['SCORE'] = session.get('SCORE', 0) + 1
         heading = "Correct!"
-        message = f"'{q['correct_answer']}' is the right answer!"
+        message = f"'{correct_answer}' is the right answer!"
     else:
         heading = "Incorrect!"
-        message = f"The correct answer is '{q['correct_answer']}'."
+        message = f"The correct answer is '{correct_answer}'."
 
     # Determine what to show next: another question or final results
-    if q_idx + 1 < len(session['QUESTIONS']):
+    if q_idx + 1 < len(questions):
         # More questions remaining - show feedback and "Next Question" button
         session['CURRENT_QUESTION_IDX'] = q_idx + 1
         return Section(
             H1(heading, cls="text-4xl font-bold text-center"),
             P(message, cls="text-3xl font-bold text-center py-8 focus:outline-none", **focus_attrs),
-            P(NextButton(), cls="py-8"),
+            P(NEXT_BUTTON, cls="py-8"),
             cls="space-y-14",
             id="quiz-content"
         )
@@ -314,44 +524,23 @@ def post(session, choice_idx: int):
         return Section(
             H1(heading, cls="text-4xl font-bold text-center"),
             P(message, cls="text-3xl font-bold text-center py-8 focus:outline-none", **focus_attrs),
-            P(SeeResultsButton(), cls="py-8"),
+            P(SEE_RESULTS_BUTTON, cls="py-8"),
             cls="space-y-14",
             id="quiz-content"
         )
 
 @rt('/results')
-def results(session):
+def results(session, request):
     """
     Display final quiz results with score and performance message.
-    Message and emoji vary based on how many questions were answered correctly.
+    htmx swaps get the prerendered HTML for this score.
     """
     score = session.get('SCORE', 0)
-    total = 5
-    
-    # Build results message
-    if score == total:
-        emoji = "🏆"
-        message = "Every answer landed like a headshot. Boom!"
-    elif score >= 4:
-        emoji = "🌟"
-        message = "One slip, but the rest were clean combos."
-    elif score >= 3:
-        emoji = "👾"
-        message = "Not quite a speed run."
-    elif score >= 2:
-        emoji = "🕹️"
-        message = "Button masher!"
-    else:
-        emoji = "📺"
-        message = "Every expert was once a beginner."
-    
-    return Section(
-        Span(emoji, cls="text-3xl font-bold block text-center"),
-        H1(f"{score} out of {total}", cls="text-4xl font-bold text-center"),
-        P(message, cls="text-2xl font-bold text-center focus:outline-none", **focus_attrs),
-        PlayAgainButton(),
-        cls="space-y-14",
-        id="quiz-content"
-    )
+
+    # Only scores 0-5 are prerendered; anything else (e.g. from a replayed
+    # cookie) is rendered on the spot rather than failing
+    if is_htmx_swap(request) and 0 <= score < len(RESULTS_HTML):
+        return FragmentResponse(RESULTS_HTML[score])
+    return ResultsSection(score)
 
 serve()
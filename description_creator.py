@@ -1,65 +1,258 @@
 import os
 from dotenv import load_dotenv
-from huggingface_hub import InferenceClient
-import json
-import time
+from huggingface_hub import AsyncInferenceClient, InferenceTimeoutError
+from huggingface_hub.utils import HfHubHTTPError
+import asyncio
+import functools
+import orjson
+import re
+import stat
+import tempfile
+
+# huggingface_hub talks to HF over httpx (httpx2 in newer releases)
+try:
+    import httpx2 as httpx
+except ImportError:
+    import httpx
 
 load_dotenv()
 
 # Initialise Hugging Face client for LLM access
-client = InferenceClient(
+client = AsyncInferenceClient(
     provider="auto",
     api_key=os.getenv('HF_READ_API_KEY')
 )
 
+# How many LLM requests can be in flight at once
+MAX_CONCURRENT_REQUESTS = 8
+# Give up on a prompt after this many rate limits or transient errors in a row
+MAX_HF_RETRIES = 5
+# Back-off used when a 429 doesn't send a usable Retry-After header
+DEFAULT_RETRY_AFTER = 60
+# Back-off after other transient errors (timeouts, 5xx)
+TRANSIENT_RETRY_AFTER = 5
+# HTTP statuses other than 429 that are worth retrying
+TRANSIENT_STATUS_CODES = frozenset({408, 500, 502, 503, 504})
+# Re-ask this many times when the response can't be cleaned into a description
+MAX_BAD_GENERATION_RETRIES = 3
+
+# How many games to ask for in a single prompt
+GAMES_PER_PROMPT = 10
+# Room for 5 descriptions each for a full batch of games, plus the JSON around them
+BATCH_MAX_TOKENS = 1500
+
+# Semaphore capping in-flight requests, see get_request_slots()
+_request_slots = None
+_request_slots_loop = None
+
+# Words that shouldn't appear at the end of a description
+BAD_ENDINGS = frozenset({'a', 'an', 'the', 'and', 'or', 'to', 'at', 'on', 'in', 'with', 'for', 'by', 'of'})
+# Everything up to the end of the first line or the first ". ", whichever comes first
+FIRST_SENTENCE_RE = re.compile(r'[^\n]*?(?=\. |\n|$)')
+# Matching quotation marks wrapped around the entire description
+WRAPPING_QUOTES_RE = re.compile(r'(["\'])(.*)\1')
+# Markdown code fence the model sometimes wraps its JSON in
+CODE_FENCE_RE = re.compile(r'^\s*```(?:json)?\s*|\s*```\s*$')
+
 def load_games():
-    with open('games.json', 'r') as f:
-        return json.load(f)
+    with open('games.json', 'rb') as f:
+        return orjson.loads(f.read())
+
+# === DESCRIPTION STORAGE ===
+# Finished games are appended to a JSONL log as they complete, and the full
+# JSON file is only rewritten once at the end of a run.
+DESCRIPTIONS_FILE = 'game_descriptions.json'
+DESCRIPTIONS_LOG = 'game_descriptions.jsonl'
+
+def load_descriptions():
+    """
+    Load saved descriptions, replaying any games logged since the last full save.
+    Returns an empty dict if nothing has been saved yet.
+    """
+    try:
+        with open(DESCRIPTIONS_FILE, 'rb') as f:
+            descriptions = orjson.loads(f.read())
+    except FileNotFoundError:
+        descriptions = {}
+
+    try:
+        with open(DESCRIPTIONS_LOG, 'rb') as f:
+            for line in f:
+                try:
+                    descriptions.update(orjson.loads(line))
+                except orjson.JSONDecodeError:
+                    # Half-written line from an interrupted run - the rest may still be good
+                    continue
+    except FileNotFoundError:
+        pass
+
+    return descriptions
+
+def open_log():
+    """
+    Open the descriptions log for appending.
+    An interrupted run can leave a half-written last line; cut it off first so
+    the next record starts on a line of its own instead of merging into it.
+    """
+    log = open(DESCRIPTIONS_LOG, 'ab+')
+    size = log.seek(0, os.SEEK_END)
+    if size:
+        log.seek(0)
+        contents = log.read()
+        if not contents.endswith(b'\n'):
+            log.truncate(contents.rfind(b'\n') + 1)
+    return log
+
+def log_descriptions(log, game_title, game_descriptions):
+    """Append one game's descriptions to the open log and make sure they hit the disk."""
+    log.write(orjson.dumps({game_title: game_descriptions}) + b'\n')
+    log.flush()
+    os.fsync(log.fileno())
+
+def descriptions_file_mode():
+    """Permissions for game_descriptions.json: the existing file's, or the umask default."""
+    try:
+        return stat.S_IMODE(os.stat(DESCRIPTIONS_FILE).st_mode)
+    except FileNotFoundError:
+        # os.umask() can only be read by setting it, so put it straight back
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+def write_descriptions(descriptions):
+    """
+    Atomically replace game_descriptions.json, then remove the log it now covers.
+    Writes to a temp file first so an interrupted save never leaves a truncated file.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(DESCRIPTIONS_FILE)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(orjson.dumps(descriptions, option=orjson.OPT_INDENT_2))
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp files are owner-only; keep the permissions a plain open() would
+        # give so the web app can still read the file as another user
+        os.chmod(tmp_path, descriptions_file_mode())
+        os.replace(tmp_path, DESCRIPTIONS_FILE)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+    if os.path.exists(DESCRIPTIONS_LOG):
+        os.remove(DESCRIPTIONS_LOG)
 
 # === LLM INTERACTION ===
-def hf_connect(content):
-    """Send prompt to Hugging Face LLM and return response."""
-    response = client.chat_completion(
-        model="google/gemma-2-2b-it",
-        messages=[{"role": "user", "content": content}]
-    )
-    return response
+class HFTransientError(Exception):
+    """A Hugging Face call failed in a way that's worth retrying after a short wait."""
+
+class HFRateLimit(HFTransientError):
+    """Hugging Face rate limited us (HTTP 429). retry_after is how long to wait, in seconds."""
+    def __init__(self, message, retry_after=DEFAULT_RETRY_AFTER):
+        super().__init__(message)
+        self.retry_after = retry_after
 
+def retry_after_seconds(response):
+    """How long a 429 response asked us to wait, falling back to DEFAULT_RETRY_AFTER."""
+    try:
+        return max(int(response.headers.get('Retry-After')), 1)
+    except (AttributeError, TypeError, ValueError):
+        # Missing header, or an HTTP-date rather than a number of seconds
+        return DEFAULT_RETRY_AFTER
+
+def get_request_slots():
+    """
+    Semaphore capping in-flight LLM requests at MAX_CONCURRENT_REQUESTS.
+    Created on first use, and again for each new event loop, since a
+    semaphore can't be shared between separate asyncio.run() calls.
+    """
+    global _request_slots, _request_slots_loop
+    loop = asyncio.get_running_loop()
+    if _request_slots is None or _request_slots_loop is not loop:
+        _request_slots = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        _request_slots_loop = loop
+    return _request_slots
+
+async def hf_connect(content, max_tokens=None):
+    """
+    Send prompt to Hugging Face LLM and return response.
+    Raises HFRateLimit on HTTP 429 and HFTransientError on timeouts, connection
+    problems and other retryable statuses, so callers can tell those apart
+    from a real failure.
+    """
+    try:
+        async with get_request_slots():
+            return await client.chat_completion(
+                model="google/gemma-2-2b-it",
+                messages=[{"role": "user", "content": content}],
+                max_tokens=max_tokens
+            )
+    except HfHubHTTPError as e:
+        response = getattr(e, 'response', None)
+        status_code = getattr(response, 'status_code', None)
+        if status_code == 429:
+            raise HFRateLimit(str(e), retry_after_seconds(response)) from e
+        if status_code in TRANSIENT_STATUS_CODES:
+            raise HFTransientError(str(e)) from e
+        raise
+    except (InferenceTimeoutError, httpx.TransportError, TimeoutError, ConnectionError) as e:
+        # Timed out or never reached HF - worth another go after a short wait
+        raise HFTransientError(f"{type(e).__name__}: {e}") from e
+
+async def retry_transient(call, label):
+    """
+    Await call(), waiting and trying again whenever it raises HFTransientError.
+    Rate limits wait for as long as HF asked; other transient errors only briefly.
+    Re-raises the last error after MAX_HF_RETRIES attempts.
+    """
+    for attempt in range(1, MAX_HF_RETRIES + 1):
+        try:
+            return await call()
+        except HFRateLimit as e:
+            if attempt == MAX_HF_RETRIES:
+                raise
+            wait = e.retry_after
+            print(f"{label}: rate limited - sleeping {wait}s... (attempt {attempt}/{MAX_HF_RETRIES})")
+        except HFTransientError as e:
+            if attempt == MAX_HF_RETRIES:
+                raise
+            wait = TRANSIENT_RETRY_AFTER
+            print(f"{label}: {e} - sleeping {wait}s... (attempt {attempt}/{MAX_HF_RETRIES})")
+        await asyncio.sleep(wait)
+
+class BadGeneration(Exception):
+    """The LLM response couldn't be cleaned into a usable description."""
+
+@functools.lru_cache(maxsize=4096)
 def clean_description(description):
     """
     Clean up LLM response to ensure it's concise and properly formatted.
+    Cached, as the LLM often repeats itself and this is a pure function of the text.
     
     Handles common issues:
     - Removes wrapping quotation marks
     - Strips incomplete endings (e.g. "and", "a", "the")
     - Limits to 7 words maximum
-    - Ensures minimum 4 words or uses fallback
+    - Ensures minimum 4 words or raises BadGeneration
     """
-    # Words that shouldn't appear at the end of a description
-    bad_endings = {'a', 'an', 'the', 'and', 'or', 'to', 'at', 'on', 'in', 'with', 'for', 'by', 'of'}
-    
     # Take only the first line and first sentence
-    line = description.split('\n')[0]
-    first_sentence = line.split('. ')[0]
-    first_sentence = first_sentence.replace('*', '')
+    first_sentence = FIRST_SENTENCE_RE.match(description).group(0).replace('*', '')
     
     # Remove quotation marks that wrap the entire description
-    if (first_sentence.startswith('"') and first_sentence.endswith('"')) or \
-       (first_sentence.startswith("'") and first_sentence.endswith("'")):
-        first_sentence = first_sentence[1:-1]
+    quoted = WRAPPING_QUOTES_RE.fullmatch(first_sentence)
+    if quoted:
+        first_sentence = quoted.group(2)
     
-    # Split into words and limit to 7
-    words = first_sentence.split()
-    words = words[:7]
+    # Split into words and limit to 7, without splitting the rest of the text
+    words = first_sentence.split(None, 7)[:7]
     
     # Remove trailing words that leave the description incomplete
     # Keep at least 4 words to maintain meaning
-    while len(words) > 4 and words[-1].lower().rstrip(',.!?') in bad_endings:
+    while len(words) > 4 and words[-1].rstrip(',.!?').lower() in BAD_ENDINGS:
         words.pop()
     
-    # If too short after cleaning, use generic fallback
+    # If too short after cleaning, there's nothing worth keeping
     if len(words) < 4:
-        return "Mystery game with secrets"
+        raise BadGeneration(f"only {len(words)} usable words")
     
     # Capitalise first word for proper formatting
     if words:
@@ -67,10 +260,13 @@ def clean_description(description):
     
     return ' '.join(words).strip()
 
-def generate_game_description(game):
+async def generate_game_description(game):
     """
     Generate a humorous 5-word description for a game using LLM.
-    Returns cleaned description or fallback on error.
+    Returns cleaned description, or the fallback on an unexpected error or
+    when every attempt comes back unusable. Unusable responses are re-asked
+    straight away; rate limits and other transient errors are raised for the
+    caller to back off and retry.
     """
     # Detailed prompt with examples to guide the LLM's output style
     prompt=f"""In exactly 5 words, describe the core mechanics of '{game}' in a hilarious and quirky way.
@@ -93,26 +289,162 @@ def generate_game_description(game):
         Asteroids - Blast rocks make smaller problems
 
         Respond with only the 5-word description based on the rules provided. Do not return anything else."""
+    for attempt in range(1, MAX_BAD_GENERATION_RETRIES + 1):
+        try:
+            r = await hf_connect(prompt)
+            return clean_description(r.choices[0].message.content)
+        except HFTransientError:
+            raise
+        except BadGeneration as e:
+            # A content problem, not a rate limit, so there's no need to wait
+            print(f"{game}: bad response, {e} - retrying (attempt {attempt}/{MAX_BAD_GENERATION_RETRIES})")
+        except Exception as e:
+            # Log error for debugging but don't crash the game
+            # (includes malformed responses, e.g. no choices or no content)
+            print(f"\n{game}: ERROR - {e}")
+            return "Mystery game with secrets"
+
+    return "Mystery game with secrets"
+    
+
+def parse_batch_response(content, game_titles):
+    """
+    Pull each game's cleaned descriptions out of a batch response.
+    Games that are missing, malformed or short of 5 usable descriptions are
+    left out so the caller can retry them one at a time.
+    """
+    try:
+        data = orjson.loads(CODE_FENCE_RE.sub('', content))
+    except orjson.JSONDecodeError:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+
+    results = {}
+    for game_title in game_titles:
+        descs = data.get(game_title)
+        if not isinstance(descs, list):
+            continue
+        cleaned = []
+        for desc in descs:
+            if not isinstance(desc, str):
+                continue
+            try:
+                cleaned.append(clean_description(desc))
+            except BadGeneration:
+                continue
+        if len(cleaned) >= 5:
+            results[game_title] = cleaned[:5]
+    return results
+
+async def generate_batch_descriptions(game_titles):
+    """
+    Generate 5 descriptions for each of several games with a single LLM call.
+    Returns a dict of game title -> descriptions for the games that came back usable.
+    Rate limits and other transient errors are raised for the caller to retry.
+    """
+    game_list = '\n'.join(f"- {title}" for title in game_titles)
+    prompt=f"""For each of the following games, write 5 different descriptions of its core mechanics in a hilarious and quirky way.
+
+        Games:
+{game_list}
+
+        Rules:
+        - Each description must be exactly 5 words
+        - Each must be a complete thought within those 5 words, not cut off mid-sentence
+        - Use only plain text, no special characters, no emojis or formatting
+        - Do not use the game's name, character names, genre labels, or words from the title
+        - Include unique details to distinguish it from similar games
+
+        Examples:
+        Minesweeper - Guessing with explosive consequences
+        Doom - Angry metal shotguns demon confetti
+        Halo - Space monks argue with bullets
+        Pong - Two lines chasing one ball
+
+        Respond with only a JSON object mapping each game name, exactly as written above, to a list of its 5 descriptions. Do not return anything else."""
     try:
-        r = hf_connect(prompt)
-        return clean_description(r.choices[0].message.content)
+        r = await hf_connect(prompt, max_tokens=BATCH_MAX_TOKENS)
+        return parse_batch_response(r.choices[0].message.content, game_titles)
+    except HFTransientError:
+        raise
     except Exception as e:
-        # Log error for debugging but don't crash the game
-        print(f"\n{game}: ERROR - {e}")
-        return "Mystery game with secrets"
-    
+        # Every game in the batch falls back to being generated on its own
+        print(f"\nBatch of {len(game_titles)}: ERROR - {e}")
+        return {}
 
-def generate_descriptions_for_all_games():
+async def generate_five_descriptions(game_title):
+    """Collect 5 descriptions for one game, retrying fallback results a few times."""
+    game_descriptions = []
+    retry_count = 0
+    max_retries = 3  # Stop after 3
+
+    print(f"For {game_title} ...")
+    while len(game_descriptions) < 5:
+        try:
+            desc = await retry_transient(lambda: generate_game_description(game_title), game_title)
+        except HFTransientError as e:
+            print(f"Giving up on {game_title} - {e}")
+            break
+
+        # Rate limits were already waited out and unusable responses re-asked,
+        # so a fallback here is an unexpected error - try again a few times
+        if desc == "Mystery game with secrets":
+            retry_count += 1
+            if retry_count >= max_retries:
+                print(f"Max retries reached for {game_title} - stopping")
+                break
+            print(f"No description for {game_title} - retrying (attempt {retry_count}/{max_retries})")
+            continue
+
+        game_descriptions.append(desc)
+        retry_count = 0  # Reset on success
+
+    return game_descriptions
+
+async def save_descriptions(descriptions, completed):
+    """
+    Single writer for the descriptions log.
+    Games finish in any order, so they're all funnelled through this one task
+    and logged as they arrive. A None on the queue means every game is done.
+    """
+    with open_log() as log:
+        while True:
+            item = await completed.get()
+            if item is None:
+                break
+            game_title, game_descriptions = item
+            descriptions[game_title] = game_descriptions
+            log_descriptions(log, game_title, game_descriptions)
+            print(f"Completed {game_title}")
+
+async def generate_descriptions_for_all_games():
     games = load_games()
     
     # Load existing descriptions if file exists (for resuming)
     # HF has at times chucked up errors so to handle interruptions
-    try:
-        with open('game_descriptions.json', 'r') as f:
-            descriptions = json.load(f)
-    except FileNotFoundError:
-        descriptions = {}
-    
+    descriptions = load_descriptions()
+
+    completed = asyncio.Queue()
+    writer = asyncio.create_task(save_descriptions(descriptions, completed))
+
+    async def gen_one(game_title):
+        game_descriptions = await generate_five_descriptions(game_title)
+        await completed.put((game_title, game_descriptions))
+
+    async def gen_batch(game_titles):
+        print(f"For {', '.join(game_titles)} ...")
+        try:
+            results = await retry_transient(lambda: generate_batch_descriptions(game_titles),
+                                            f"Batch of {len(game_titles)}")
+        except HFTransientError:
+            results = {}
+        for game_title, game_descriptions in results.items():
+            await completed.put((game_title, game_descriptions))
+        # Only games the batch didn't cover go back to one prompt per description
+        await asyncio.gather(*[gen_one(t) for t in game_titles if t not in results])
+
+    pending = []
     for game in games:
         game_title = game['game']
         
@@ -120,71 +452,66 @@ def generate_descriptions_for_all_games():
         if game_title in descriptions:
             print(f"Skipping {game_title} - already exists")
             continue
-        
-        game_descriptions = []
-        retry_count = 0
-        max_retries = 3  # Stop after 3
+        pending.append(game_title)
 
-        print(f"For {game_title} ...")
-        while len(game_descriptions) < 5:
-            desc = generate_game_description(game_title)
-            
-            if desc == "Mystery game with secrets":
-                retry_count += 1
-                if retry_count >= max_retries:
-                    print(f"Max retries reached for {game_title} - stopping")
-                    break
-                print(f"Rate limited - sleeping 60s... (attempt {retry_count}/{max_retries})")
-                time.sleep(60)
-                continue
-    
-            game_descriptions.append(desc)
-            retry_count = 0  # Reset on success
-            time.sleep(5)
-        
-        # # Save after each game
-        descriptions[game_title] = game_descriptions
-        with open('game_descriptions.json', 'w') as f:
-            json.dump(descriptions, f, indent=2)
-        
-        print(f"Completed {game_title}")
-        time.sleep(30)  # Rate limit protection
+    # Batches overlap, with get_request_slots() capping how many requests are in flight
+    await asyncio.gather(*[gen_batch(pending[i:i + GAMES_PER_PROMPT])
+                           for i in range(0, len(pending), GAMES_PER_PROMPT)])
+    await completed.put(None)
+    await writer
+
+    # One full rewrite at the end instead of one per game, kept in
+    # games.json order however the games happened to finish
+    order = {game['game']: i for i, game in enumerate(games)}
+    write_descriptions(dict(sorted(descriptions.items(), key=lambda item: order.get(item[0], len(order)))))
 
-def fix_mystery_descriptions():
+async def fix_mystery_descriptions():
     """Replace 'mystery game with secrets' descriptions with new ones."""
-    with open('game_descriptions.json', 'r') as f:
-        descriptions = json.load(f)
-    
-    for game_title, descs in descriptions.items():
-        # Find indices of mystery descriptions
-        mystery_indices = [i for i, d in enumerate(descs) if d == "Mystery game with secrets"]
-        
-        if not mystery_indices:
-            continue
-        
-        print(f"Fixing {len(mystery_indices)} descriptions for {game_title}")
-        
-        for idx in mystery_indices:
-            new_desc = generate_game_description(game_title)
-            
-            # Retry if we get another mystery
+    descriptions = load_descriptions()
+
+    async def fix_one(game_title, idx):
+        try:
+            new_desc = await retry_transient(lambda: generate_game_description(game_title), game_title)
+
+            # Retry straight away if we get another mystery
             retry_count = 0
             while new_desc == "Mystery game with secrets" and retry_count < 5:
-                print(f"  Rate limited - sleeping 60s...")
-                time.sleep(60)
-                new_desc = generate_game_description(game_title)
+                print(f"  No description for {game_title} - retrying...")
+                new_desc = await retry_transient(lambda: generate_game_description(game_title), game_title)
                 retry_count += 1
-            
-            descriptions[game_title][idx] = new_desc
-            time.sleep(5)
-        
+        except HFTransientError as e:
+            # Leave the mystery in place for a later run
+            print(f"  Giving up on {game_title} - {e}")
+            return
+
+        descriptions[game_title][idx] = new_desc
+
+    async def fix_game(log, game_title, mystery_indices):
+        print(f"Fixing {len(mystery_indices)} descriptions for {game_title}")
+        await asyncio.gather(*[fix_one(game_title, idx) for idx in mystery_indices])
+
         # Save after each game
-        with open('game_descriptions.json', 'w') as f:
-            json.dump(descriptions, f, indent=2)
+        log_descriptions(log, game_title, descriptions[game_title])
+
+    with open_log() as log:
+        fixes = []
+        for game_title, descs in descriptions.items():
+            # Find indices of mystery descriptions
+            mystery_indices = [i for i, d in enumerate(descs) if d == "Mystery game with secrets"]
+            
+            if not mystery_indices:
+                continue
+
+            fixes.append(fix_game(log, game_title, mystery_indices))
+
+        # Requests overlap, with get_request_slots() capping how many are in flight
+        await asyncio.gather(*fixes)
+
+    write_descriptions(descriptions)
     
     print("All mystery descriptions fixed!")
 
 
 if __name__ == "__main__":
-    generate_descriptions_for_all_games()
-    # Or: fix_mystery_descriptions()
+    asyncio.run(generate_descriptions_for_all_games())
+    # Or: asyncio.run(fix_mystery_descriptions())